@@ -0,0 +1,126 @@
+"""
+Module to slow fan-out scripts down when the queue they feed is backing up.
+
+Each fan-out script watches the depth of its downstream queue.  Below the low water mark it runs at full speed,
+between the low and high water marks it sleeps a little before each message, and above the high water mark it
+pauses until the queue drains back below the low water mark.  The whole pipeline then runs at the speed of its
+slowest stage instead of building up an unbounded backlog.
+"""
+import os
+import time
+import logging
+
+import sqs
+
+HIGH_WATER_MARK = int(os.getenv('BACKPRESSURE_HIGH_WATER_MARK', 10000))
+LOW_WATER_MARK = int(os.getenv('BACKPRESSURE_LOW_WATER_MARK', 2000))
+MAX_THROTTLE_DELAY = float(os.getenv('BACKPRESSURE_MAX_DELAY', 5))
+DEPTH_CHECK_INTERVAL = float(os.getenv('BACKPRESSURE_CHECK_INTERVAL', 10))
+METRIC_INTERVAL = float(os.getenv('BACKPRESSURE_METRIC_INTERVAL', 60))
+# Extra time a held message stays hidden past a throttle sleep, to cover the sends that follow it.
+MESSAGE_HOLD_MARGIN = float(os.getenv('BACKPRESSURE_MESSAGE_HOLD_MARGIN', 30))
+
+OPEN = 'open'
+THROTTLED = 'throttled'
+PAUSED = 'paused'
+
+STATE_VALUES = {OPEN: 0, THROTTLED: 1, PAUSED: 2}
+
+
+def get_queue_depth(queue):
+    """
+    Get the approximate number of visible messages waiting in the queue.
+
+    See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#SQS.Queue.attributes
+    :param queue: The queue to check.
+    :return: Number of messages.
+    """
+    queue.load()
+    return int(queue.attributes.get('ApproximateNumberOfMessages', 0))
+
+
+class Throttle:
+    def __init__(self, queue, high_water_mark=HIGH_WATER_MARK, low_water_mark=LOW_WATER_MARK,
+                 max_delay=MAX_THROTTLE_DELAY, check_interval=DEPTH_CHECK_INTERVAL):
+        """
+        Class to pace a script against the depth of the queue it sends to.
+
+        The queue depth is only fetched every check_interval seconds so the throttle itself doesn't add an SQS
+        call per message.
+        :param queue: Downstream queue to watch.
+        :param high_water_mark: Depth at which the script pauses.
+        :param low_water_mark: Depth below which the script runs at full speed, and at which a pause ends.
+        :param max_delay: Delay before each message just below the high water mark.
+        :param check_interval: Seconds between depth checks.
+        """
+        self.queue = queue
+        self.high_water_mark = high_water_mark
+        self.low_water_mark = low_water_mark
+        self.max_delay = max_delay
+        self.check_interval = check_interval
+        self.state = OPEN
+        self.depth = 0
+        self.delay = 0
+        self.checked_at = 0
+        self.reported_at = 0
+
+    def refresh(self):
+        """
+        Re-reads the queue depth if it is stale and updates the throttle state.
+
+        :return:
+        """
+        now = time.time()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        self.depth = get_queue_depth(self.queue)
+        previous_state = self.state
+        if self.depth >= self.high_water_mark or (self.state == PAUSED and self.depth > self.low_water_mark):
+            self.state = PAUSED
+            self.delay = self.check_interval
+        elif self.depth > self.low_water_mark:
+            self.state = THROTTLED
+            fill = (self.depth - self.low_water_mark) / float(self.high_water_mark - self.low_water_mark)
+            self.delay = fill * self.max_delay
+        else:
+            self.state = OPEN
+            self.delay = 0
+        if self.state != previous_state or now - self.reported_at >= METRIC_INTERVAL:
+            self.report()
+
+    def report(self):
+        """
+        Logs the throttle state as a metric line.
+
+        :return:
+        """
+        self.reported_at = time.time()
+        logging.info('metric=backpressure queue={} state={} state_value={} depth={} delay={:.2f}'.format(
+            getattr(self.queue, 'url', self.queue), self.state, STATE_VALUES[self.state], self.depth, self.delay))
+
+    def wait(self, message=None):
+        """
+        Blocks for as long as the downstream queue needs the script to slow down.
+
+        :param message: Message currently being worked on, kept hidden from other workers while the script sleeps.
+        :return:
+        """
+        self.refresh()
+        while self.state == PAUSED:
+            self.sleep(self.delay, message)
+            self.refresh()
+        if self.delay:
+            self.sleep(self.delay, message)
+
+    def sleep(self, delay, message=None):
+        """
+        Sleeps, first extending the visibility of the message being worked on past the sleep.
+
+        :param delay: Seconds to sleep.
+        :param message: Message currently being worked on, if any.
+        :return:
+        """
+        if message is not None:
+            sqs.delay_message(message, delay + MESSAGE_HOLD_MARGIN)
+        time.sleep(delay)
@@ -0,0 +1,65 @@
+"""
+Measures how long each queue script takes to import, which is the time an autoscaled worker spends before it
+can start polling.
+
+Each entry point is imported in a fresh interpreter so module caches don't hide the cost.
+
+Usage: python benchmark_startup.py [--runs N] [module ...]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from statistics import median
+
+ENTRY_POINTS = [
+    'lat_lng_queue',
+    'radar_search_queue',
+    'google_places_queue',
+    'fs_details_queue',
+    'fs_menu_details_queue',
+    'quarantine',
+    'data_parsers.helper_classes.data_parser',
+]
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(module):
+    """
+    Imports the module in a new interpreter.
+
+    :param module: Dotted module name to import.
+    :return: Wall clock seconds for the interpreter to start and import the module.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import {}'.format(module)], cwd=ROOT_DIR, check=True)
+    return time.perf_counter() - start
+
+
+def baseline():
+    """
+    Time for a bare interpreter to start, subtracted from every measurement.
+
+    :return: Seconds.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+
+def run(modules, runs):
+    interpreter = median(baseline() for _ in range(runs))
+    print('interpreter startup: {:.1f} ms'.format(interpreter * 1000))
+    for module in modules:
+        times = [time_import(module) - interpreter for _ in range(runs)]
+        print('{:<45} median {:7.1f} ms  min {:7.1f} ms'.format(module, median(times) * 1000, min(times) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark startup time of the queue scripts.')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    run(args.modules, args.runs)
@@ -2,21 +2,10 @@
 Contains classes to parse data for application.
 """
 import os
-import requests
-import time
-import json
 import logging
-import argparse
-import contextlib
-import sqlalchemy
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
 
 responses_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'responses')
 
-engine = sqlalchemy.create_engine(os.environ.get('HAPPYFINDER_ENGINE'), encoding='utf8')
-Session = sessionmaker(engine)
-
 
 class Base:
     def __init__(self, data):
@@ -9,11 +9,11 @@ import logging
 import time
 import json
 from contextlib import closing
-import sqlalchemy
-from sqlalchemy.orm import sessionmaker
 
 import sqs
+from resources import get_session
 from helpers import APIHandler, Alternator
+from quarantine import Quarantine
 from data_parsers.helper_classes import FoursquareDetails
 
 BOTO_QUEUE_NAME_FS_DETAILS = 'fs_details_queue'
@@ -24,9 +24,6 @@ DELETE FROM happyfinder_schema.happyfinder
 WHERE fs_venue_id = :fs_venue_id;
 """
 
-engine = sqlalchemy.create_engine(os.getenv('HAPPYFINDER_ENGINE'), encoding='utf8')
-Session = sessionmaker(engine)
-
 
 def make_url(data, credentials):
     """
@@ -48,7 +45,7 @@ def delete(fs_venue_id):
     :param fs_venue_id: Foursquare venue ID.
     :return:
     """
-    with closing(Session()) as s:
+    with closing(get_session()) as s:
         try:
             s.execute(DELETE_QUERY, params={'fs_venue_id': fs_venue_id})
         except Exception:
@@ -90,6 +87,7 @@ def run():
     credentials_alternator = Alternator()
     fs_details_queue = sqs.get_queue(BOTO_QUEUE_NAME_FS_DETAILS)
     menu_queue = sqs.get_queue(BOTO_QUEUE_NAME_FS_MENU)
+    quarantine = Quarantine(BOTO_QUEUE_NAME_FS_DETAILS, fs_details_queue)
     while True:
         message = sqs.get_message(fs_details_queue)
         if not message:
@@ -98,8 +96,9 @@ def run():
             continue
         logging.info('menu queue: {}\nmessage.body:{}'.format(menu_queue, message.body))
         credentials = credentials_alternator.toggle_foursquare_values()
-        make_request(menu_queue, message.body, credentials)
-        sqs.delete_message(fs_details_queue, message)
+        with quarantine.isolate(message):
+            make_request(menu_queue, message.body, credentials)
+            sqs.delete_message(fs_details_queue, message)
 
 
 if __name__ == '__main__':
@@ -7,18 +7,15 @@ import logging
 import time
 import json
 from contextlib import closing
-import sqlalchemy
-from sqlalchemy.orm import sessionmaker
 
 from helpers import APIHandler
 import sqs
+from resources import get_session
 from data_parsers.helper_classes import FoursquareVenueDetails
+from quarantine import Quarantine
 
 BOTO_QUEUE_NAME_FS_MENU = 'fs_menu_details_queue'
 
-engine = sqlalchemy.create_engine(os.getenv('HAPPYFINDER_ENGINE'), encoding='utf8')
-Session = sessionmaker(engine)
-
 UPDATE_QUERY = """
 UPDATE happyfinder_schema.happyfinder SET
 happy_hour_string = :happy_hour_string,
@@ -44,7 +41,7 @@ def parse_data(data):
     category = data.get('category')
     api_data = api.get_load()
     parsed_data = FoursquareVenueDetails(api_data)
-    with closing(Session()) as s:
+    with closing(get_session()) as s:
         try:
             if parsed_data.happy_hour_string:
                 s.execute(UPDATE_QUERY, params={
@@ -65,18 +62,21 @@ def run():
     """
     Runner for the script.
 
+    A message that keeps failing is moved to the quarantine queue instead of stopping the script.
     :return:
     """
     menu_queue = sqs.get_queue(BOTO_QUEUE_NAME_FS_MENU)
+    quarantine = Quarantine(BOTO_QUEUE_NAME_FS_MENU, menu_queue)
     while True:
         message = sqs.get_message(menu_queue)
         if not message:
             logging.info(os.path.basename(__file__))
             time.sleep(5)
             continue
-        data = json.loads(message.body)
-        parse_data(data)
-        sqs.delete_message(menu_queue, message)
+        with quarantine.isolate(message):
+            data = json.loads(message.body)
+            parse_data(data)
+            sqs.delete_message(menu_queue, message)
 
 
 if __name__ == '__main__':
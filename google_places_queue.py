@@ -7,22 +7,20 @@ import logging
 import time
 from contextlib import closing
 import json
-import sqlalchemy
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
 
 from helpers import APIHandler, Alternator
 from data_parsers.helper_classes import GoogleDetails, FoursquareDetails
 import sqs
+from resources import get_session
+from quota import QuotaExceededError, DETAILS_BUCKET
+from quarantine import Quarantine
 
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+PLACES_HEDGE_AFTER = float(os.getenv('PLACES_HEDGE_AFTER')) if os.getenv('PLACES_HEDGE_AFTER') else None
 
 BOTO_QUEUE_NAME_FS_DETAILS = 'fs_details_queue'
 BOTO_QUEUE_NAME_PLACES = 'google_places_queue'
 
-engine = sqlalchemy.create_engine(os.getenv('HAPPYFINDER_ENGINE'), encoding='utf8')
-Session = sessionmaker(engine)
-
 INSERT_QUERY = """
        INSERT INTO happyfinder_schema.happyfinder(happyfinder.name, lat, lng, hours,
        rating, phone_number, address, url, google_id, price, fs_venue_id)
@@ -53,8 +51,10 @@ def insert_data(data, fs_venue_id):
     :param fs_venue_id: Foursquare venue ID.
     :return:
     """
+    from sqlalchemy.exc import IntegrityError
+
     if fs_venue_id:
-        with closing(Session()) as s:
+        with closing(get_session()) as s:
             try:
                 s.execute(INSERT_QUERY, params={
                     'v_name': data.name.encode('utf-8') or None,
@@ -104,7 +104,7 @@ def make_request(queue, message, credentials):
     :param credentials: Foursquare credentials.
     :return:
     """
-    api = APIHandler(message)
+    api = APIHandler(message, hedge_after=PLACES_HEDGE_AFTER, quota_bucket=DETAILS_BUCKET)
     api_data = api.get_load()
     parsed_data = GoogleDetails(api_data)
     url = make_url(parsed_data, credentials)
@@ -117,6 +117,7 @@ def run():
     credentials_alternator = Alternator()
     google_places_queue = sqs.get_queue(BOTO_QUEUE_NAME_PLACES)
     foursquare_details_queue = sqs.get_queue(BOTO_QUEUE_NAME_FS_DETAILS)
+    quarantine = Quarantine(BOTO_QUEUE_NAME_PLACES, google_places_queue)
     while True:
         message = sqs.get_message(google_places_queue)
         if not message:
@@ -124,8 +125,14 @@ def run():
             time.sleep(5)
             continue
         credentials = credentials_alternator.toggle_foursquare_values()
-        make_request(foursquare_details_queue, message.body, credentials)
-        sqs.delete_message(google_places_queue, message)
+        with quarantine.isolate(message):
+            try:
+                make_request(foursquare_details_queue, message.body, credentials)
+            except QuotaExceededError as err:
+                logging.warning(err)
+                sqs.delay_message(message, err.retry_after)
+                continue
+            sqs.delete_message(google_places_queue, message)
 
 
 if __name__ == '__main__':
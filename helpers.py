@@ -3,8 +3,16 @@ import requests
 import json
 import logging
 import time
+import math
+import random
+import threading
 from itertools import cycle
 from collections import namedtuple
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlparse, parse_qs
+
+from quota import QuotaExceededError, QUOTA_RETRY_DELAY, get_quota_manager
 
 FOURSQUARE_CLIENT_ID = os.getenv('FOURSQUARE_CLIENT_ID')
 FOURSQUARE_CLIENT_SECRET = os.getenv('FOURSQUARE_CLIENT_SECRET')
@@ -12,8 +20,86 @@ SECONDARY_FOURSQUARE_CLIENT_ID = os.getenv('SECONDARY_FOURSQUARE_CLIENT_ID')
 SECONDARY_FOURSQUARE_CLIENT_SECRET = os.getenv('SECONDARY_FOURSQUARE_SECRET')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 
+ADAPTIVE_RADAR_SEARCH = os.getenv('ADAPTIVE_RADAR_SEARCH', '').lower() in ('1', 'true', 'yes')
+RADAR_RESULT_LIMIT = 200
+MIN_RADAR_RADIUS = float(os.getenv('MIN_RADAR_RADIUS', 100))
+METERS_PER_DEGREE_LAT = 111320.0
+
+CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', 30))
+MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', 3))
+BACKOFF_BASE = float(os.getenv('API_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.getenv('API_BACKOFF_MAX', 30))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('API_CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('API_CIRCUIT_RESET_TIMEOUT', 60))
+HEDGE_POOL_SIZE = int(os.getenv('API_HEDGE_POOL_SIZE', 8))
+
+RADAR_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/radarsearch/json?location={},{}&radius={}&types=restaurant&key={}"
+
 fs_credentials = namedtuple('Row', ['foursquare_client_id', 'foursquare_client_secret'])
 
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE)
+hedge_slots = threading.BoundedSemaphore(HEDGE_POOL_SIZE)
+
+
+def meters_to_degrees(meters, lat):
+    """
+    Converts a distance in meters to degrees of latitude and longitude at the given latitude.
+
+    :param meters: Distance in meters.
+    :param lat: Latitude the distance is measured at.
+    :return: Tuple of (lat degrees, lng degrees).
+    """
+    lat_degrees = meters / METERS_PER_DEGREE_LAT
+    lng_degrees = meters / (METERS_PER_DEGREE_LAT * math.cos(math.radians(lat)))
+    return lat_degrees, lng_degrees
+
+
+def make_radar_url(lat, lng, radius):
+    """
+    Generates a google radar search url for a circle.
+
+    :param lat: Latitude of the center of the circle.
+    :param lng: Longitude of the center of the circle.
+    :param radius: Radius of the circle in meters.
+    :return: The generated url.
+    """
+    return RADAR_SEARCH_URL.format(lat, lng, radius, GOOGLE_API_KEY)
+
+
+def parse_radar_url(url):
+    """
+    Reads the circle back out of a google radar search url.
+
+    :param url: Radar search url built by make_radar_url.
+    :return: Tuple of (lat, lng, radius).
+    """
+    query = parse_qs(urlparse(url).query)
+    lat, lng = query['location'][0].split(',')
+    return float(lat), float(lng), float(query['radius'][0])
+
+
+def subdivide_radar_cell(lat, lng, radius):
+    """
+    Splits a radar search circle into the four circles of its quadtree children.
+
+    The circle is treated as circumscribing a square cell.  The cell is split into four quadrants and each
+    child circle circumscribes one quadrant, so the children cover the whole parent cell with half the radius.
+    :param lat: Latitude of the center of the parent circle.
+    :param lng: Longitude of the center of the parent circle.
+    :param radius: Radius of the parent circle in meters.
+    :return: List of (lat, lng, radius) tuples for the child circles.
+    """
+    lat_offset, lng_offset = meters_to_degrees(radius / (2 * math.sqrt(2)), lat)
+    child_radius = radius / 2
+    return [
+        (lat + lat_sign * lat_offset, lng + lng_sign * lng_offset, child_radius)
+        for lat_sign in (-1, 1)
+        for lng_sign in (-1, 1)
+    ]
+
 
 class Alternator:
     def __init__(self):
@@ -29,15 +115,107 @@ class Alternator:
         return next(self.alternator)
 
 
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        """
+        Class to stop calling an upstream host while it is failing.
+
+        After failure_threshold consecutive failures the circuit opens and requests are refused until
+        reset_timeout seconds have passed.  Then a single trial request is let through; a success closes the
+        circuit and a failure opens it again.
+        :param failure_threshold: Consecutive failures before the circuit opens.
+        :param reset_timeout: Seconds to wait before letting a trial request through.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+def get_circuit_breaker(url):
+    """
+    Gets the circuit breaker for the host of the url, creating it if needed.
+
+    :param url: Url that is about to be requested.
+    :return: CircuitBreaker shared by every request to that host.
+    """
+    host = urlparse(url).netloc
+    with circuit_breakers_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker()
+        return circuit_breakers[host]
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter.
+
+    :param attempt: Zero based number of the attempt that just failed.
+    :return: Seconds to sleep before the next attempt.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def submit_request(session, url, timeout):
+    """
+    Runs the request on the hedge pool, but only if a worker is free.
+
+    Requests never wait in the pool's queue, so a backlog of slow requests can't add to the latency of new ones.
+    :param session: requests Session to send the request with.
+    :param url: Url to request.
+    :param timeout: Connect and read timeouts.
+    :return: Future for the response, or None if every worker is busy.
+    """
+    if not hedge_slots.acquire(blocking=False):
+        return None
+    future = hedge_executor.submit(session.get, url, timeout=timeout)
+    future.add_done_callback(lambda _: hedge_slots.release())
+    return future
+
+
 class APIHandler:
-    def __init__(self, url):
+    def __init__(self, url, hedge_after=None, max_retries=MAX_RETRIES, quota_bucket=None):
         """
         Class to handle API calls and responses.
 
         Contains methods to check Foursquare response to see if my query limit has been reached.
+        Requests are made with connect and read timeouts, connection errors, timeouts and 5xx responses are
+        retried with backoff, and every host is guarded by a circuit breaker.
         :param url: Url to make the api request to.
+        :param hedge_after: If set, seconds to wait before sending a second, hedged copy of the request.
+        :param max_retries: Number of times to retry a failed request.
+        :param quota_bucket: Google quota bucket to pace the request against, if any.
         """
         self.url = url
+        self.hedge_after = hedge_after
+        self.max_retries = max_retries
+        self.quota_bucket = quota_bucket
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
 
     def get_load(self):
         """
@@ -45,10 +223,116 @@ class APIHandler:
 
         :return: Parsed json response from requested URL.
         """
-        res = requests.get(self.url)
+        res = self.fetch()
         self.check_response(res)
         str_response = res.content.decode('utf-8')
-        return json.loads(str_response)
+        data = json.loads(str_response)
+        self.check_google_status(data)
+        return data
+
+    def acquire_quota(self):
+        """
+        Takes one request from the Google quota bucket, if the handler has one.
+
+        Called for every request actually sent, including retries and hedged copies, since each one is billed.
+        :return:
+        """
+        if self.quota_bucket:
+            get_quota_manager().acquire(self.quota_bucket)
+
+    def fetch(self):
+        """
+        Makes the API call, retrying transient failures.
+
+        :return: API response.
+        """
+        breaker = get_circuit_breaker(self.url)
+        for attempt in range(self.max_retries + 1):
+            if not breaker.allow_request():
+                raise CircuitOpenError('Circuit open for {}'.format(urlparse(self.url).netloc))
+            self.acquire_quota()
+            try:
+                res = self.send()
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = err
+            else:
+                if res.status_code < 500:
+                    breaker.record_success()
+                    return res
+                error = requests.HTTPError('{} Server Error'.format(res.status_code), response=res)
+            breaker.record_failure()
+            if attempt < self.max_retries:
+                delay = backoff_delay(attempt)
+                logging.info('Request failed: {}. Retrying in {:.2f}s'.format(error, delay))
+                time.sleep(delay)
+        raise error
+
+    def send(self):
+        """
+        Sends the request, hedging it with a second copy if the first is slow.
+
+        Each copy gets its own session, and both sessions are closed once one copy has answered.  When the hedge
+        pool has no free worker the request is sent without a hedge rather than queued.
+        :return: API response from whichever request finished first without an error.
+        """
+        if self.hedge_after is None:
+            return requests.get(self.url, timeout=self.timeout)
+        sessions = [requests.Session()]
+        future = submit_request(sessions[0], self.url, self.timeout)
+        if future is None:
+            logging.info('Hedge pool is busy, sending without a hedge')
+            with closing(sessions[0]) as session:
+                return session.get(self.url, timeout=self.timeout)
+        futures = [future]
+        try:
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done:
+                self.hedge(sessions, futures)
+            error = None
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except requests.RequestException as err:
+                    error = err
+            raise error
+        finally:
+            for session in sessions:
+                session.close()
+
+    def hedge(self, sessions, futures):
+        """
+        Sends the hedged copy of a slow request, if the hedge pool has a free worker.
+
+        :param sessions: Sessions of the requests in flight, the hedge's session is added to it.
+        :param futures: Futures of the requests in flight, the hedge's future is added to it.
+        :return:
+        """
+        try:
+            self.acquire_quota()
+        except QuotaExceededError as err:
+            logging.info('Not hedging slow request: {}'.format(err))
+            return
+        session = requests.Session()
+        future = submit_request(session, self.url, self.timeout)
+        if future is None:
+            session.close()
+            logging.info('Hedge pool is busy, not hedging slow request')
+            return
+        logging.info('Hedging slow request after {}s'.format(self.hedge_after))
+        sessions.append(session)
+        futures.append(future)
+
+    def check_google_status(self, data):
+        """
+        Method to check a Google response for a quota error.
+
+        Google answers quota errors with a 200 and an OVER_QUERY_LIMIT status, which would otherwise be parsed as
+        an empty result.
+        :param data: Parsed json response.
+        :return:
+        """
+        if 'googleapis' in self.url and data.get('status') == 'OVER_QUERY_LIMIT':
+            raise QuotaExceededError(self.quota_bucket or urlparse(self.url).path, QUOTA_RETRY_DELAY)
 
     def check_response(self, res):
         """
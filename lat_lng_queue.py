@@ -5,13 +5,18 @@ Once a message is received, the message is parsed and processed to prepare the d
 import os
 import logging
 import time
+import math
 import json
 
 import sqs
+from backpressure import Throttle
+from quarantine import Quarantine
+from helpers import ADAPTIVE_RADAR_SEARCH, make_radar_url, meters_to_degrees
 
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+COARSE_RADAR_RADIUS = float(os.getenv('COARSE_RADAR_RADIUS', 3200))
 BOTO_QUEUE_NAME_RADAR = 'radar_search_queue'
 BOTO_QUEUE_NAME_LAT_LNG = 'lat_lng_queue'
+SEND_CHUNK_SIZE = 100
 
 
 def gen_coordinates(start_lat, start_lng, end_lat, end_lng):
@@ -34,31 +39,69 @@ def gen_coordinates(start_lat, start_lng, end_lat, end_lng):
     current_lng = start_lng
     while current_lat < end_lat:
         while current_lng < end_lng:
-            url_list.append(
-                "https://maps.googleapis.com/maps/api/place/radarsearch/json?location={},{}&radius={}&types=restaurant&key={}".format(
-                    current_lat, current_lng, 805, GOOGLE_API_KEY
-                ))
+            url_list.append(make_radar_url(current_lat, current_lng, 805))
             current_lng += 0.0083175
         current_lng = start_lng
         current_lat += 0.007233
     return url_list
 
 
+def gen_adaptive_coordinates(start_lat, start_lng, end_lat, end_lng, radius=COARSE_RADAR_RADIUS):
+    """
+    Generates coarse coordinates to seed an adaptive radar search.
+
+    Tiles the bounds with square cells and creates a url for the circle circumscribing each cell.  The radar
+    search queue subdivides any cell whose search comes back saturated, so only dense areas get searched at a
+    finer radius.
+    :param start_lat: Starting latitude for the generator.
+    :param start_lng: Starting longitude for the generator.
+    :param end_lat: Ending latitude for the generator.
+    :param end_lng: Ending longitude for the generator.
+    :param radius: Radius of the coarse circles in meters.
+    :return: List of url's to send to queue.
+    """
+    url_list = []
+    logging.info("Moved to next city (adaptive)...")
+    cell_size = radius * math.sqrt(2)
+    lat_step, _ = meters_to_degrees(cell_size, start_lat)
+    current_lat = start_lat + lat_step / 2
+    while current_lat - lat_step / 2 < end_lat:
+        _, lng_step = meters_to_degrees(cell_size, current_lat)
+        current_lng = start_lng + lng_step / 2
+        while current_lng - lng_step / 2 < end_lng:
+            url_list.append(make_radar_url(current_lat, current_lng, radius))
+            current_lng += lng_step
+        current_lat += lat_step
+    return url_list
+
+
 def run():
+    """
+    Runner for lat_lng_queue.py.
+
+    The urls for a city are sent in chunks, and the script slows down or pauses between chunks while the radar
+    search queue is backed up.
+    :return:
+    """
     radar_queue = sqs.get_queue(BOTO_QUEUE_NAME_RADAR)
     lat_lng_queue = sqs.get_queue(BOTO_QUEUE_NAME_LAT_LNG)
+    quarantine = Quarantine(BOTO_QUEUE_NAME_LAT_LNG, lat_lng_queue)
+    throttle = Throttle(radar_queue)
     while True:
         message = sqs.get_message(lat_lng_queue)
         if not message:
             logging.info(os.path.basename(__file__))
             time.sleep(5)
             continue
-        coordinates = json.loads(message.body)
-        urls = gen_coordinates(coordinates['start_lat'], coordinates['start_lng'], coordinates['end_lat'],
-                               coordinates['end_lng'])
-        for url in urls:
-            sqs.send_message(radar_queue, url)
-        sqs.delete_message(lat_lng_queue, message)
+        with quarantine.isolate(message):
+            coordinates = json.loads(message.body)
+            generator = gen_adaptive_coordinates if coordinates.get('adaptive', ADAPTIVE_RADAR_SEARCH) else gen_coordinates
+            urls = generator(coordinates['start_lat'], coordinates['start_lng'], coordinates['end_lat'],
+                             coordinates['end_lng'])
+            for chunk in sqs.chunks(urls, SEND_CHUNK_SIZE):
+                throttle.wait(message)
+                sqs.send_messages(radar_queue, chunk)
+            sqs.delete_message(lat_lng_queue, message)
 
 
 if __name__ == '__main__':
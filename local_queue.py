@@ -0,0 +1,222 @@
+"""
+Local queue backend stored in SQLite, for running the pipeline on one box without AWS.
+
+Queues and messages mirror the parts of the boto3 SQS Queue and Message API that sqs.py uses, so the scripts run
+unchanged against either backend.  Messages have visibility timeouts, delays and receive counts like SQS, and any
+number of processes can share the same database file.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+LOCAL_QUEUE_DB_PATH = os.getenv('LOCAL_QUEUE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                      'local_queue.db'))
+DEFAULT_VISIBILITY_TIMEOUT = int(os.getenv('LOCAL_QUEUE_VISIBILITY_TIMEOUT', 30))
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    receive_count INTEGER NOT NULL DEFAULT 0,
+    receipt_handle TEXT,
+    message_attributes TEXT
+);
+"""
+
+CREATE_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS messages_queue_visible_at ON messages (queue, visible_at, id);
+"""
+
+
+def parse_receipt_handle(receipt_handle):
+    """
+    Reads the row id back out of a receipt handle so lookups by receipt handle can use the primary key.
+
+    :param receipt_handle: Receipt handle given out by LocalQueue.receive_messages.
+    :return: Row id of the message.
+    """
+    return int(receipt_handle.split(':', 1)[0])
+
+
+class SQLiteBackend:
+    def __init__(self, path=LOCAL_QUEUE_DB_PATH):
+        """
+        Class to hand out queues stored in a local SQLite file.
+
+        The file is opened in WAL mode so readers don't block the writer, and every receive runs in an immediate
+        transaction so two processes never get the same message.
+        :param path: Path to the SQLite file.
+        """
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        conn.execute(CREATE_TABLE_QUERY)
+        conn.execute(CREATE_INDEX_QUERY)
+
+    def connection(self):
+        """
+        Get the connection for the current thread and process, opening it if needed.
+
+        :return: sqlite3 connection.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def transaction(self, func, *args):
+        """
+        Runs func with the connection inside an immediate transaction.
+
+        :param func: Callable taking the connection and args.
+        :return: Whatever func returns.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn, *args)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def get_queue(self, queue_name):
+        return LocalQueue(self, queue_name)
+
+    def create_queue(self, queue_name):
+        return LocalQueue(self, queue_name)
+
+
+class LocalQueue:
+    def __init__(self, backend, name):
+        """
+        Class mirroring boto3's SQS Queue for a queue stored in SQLite.
+
+        :param backend: SQLiteBackend the queue lives in.
+        :param name: Name of the queue.
+        """
+        self.backend = backend
+        self.name = name
+        self.url = 'sqlite:///{}#{}'.format(backend.path, name)
+
+    @property
+    def attributes(self):
+        now = time.time()
+        visible, not_visible = self.backend.connection().execute(
+            'SELECT COALESCE(SUM(visible_at <= ?), 0), COALESCE(SUM(visible_at > ?), 0) FROM messages WHERE queue = ?',
+            (now, now, self.name)).fetchone()
+        return {
+            'ApproximateNumberOfMessages': str(visible),
+            'ApproximateNumberOfMessagesNotVisible': str(not_visible),
+        }
+
+    def load(self):
+        pass
+
+    def send_message(self, MessageBody, DelaySeconds=0, MessageAttributes=None):
+        entry = {'Id': '0', 'MessageBody': MessageBody, 'DelaySeconds': DelaySeconds,
+                 'MessageAttributes': MessageAttributes}
+        result = self.send_messages([entry])['Successful'][0]
+        return {'MessageId': result['MessageId'], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def send_messages(self, Entries):
+        now = time.time()
+        rows = [(self.name, str(uuid.uuid4()), entry['MessageBody'], now, now + entry.get('DelaySeconds', 0),
+                 json.dumps(entry['MessageAttributes']) if entry.get('MessageAttributes') else None)
+                for entry in Entries]
+        self.backend.transaction(lambda conn: conn.executemany(
+            'INSERT INTO messages (queue, message_id, body, sent_at, visible_at, message_attributes) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows))
+        return {
+            'Successful': [{'Id': entry['Id'], 'MessageId': row[1]} for entry, row in zip(Entries, rows)],
+            'Failed': [],
+            'ResponseMetadata': {'HTTPStatusCode': 200},
+        }
+
+    def receive_messages(self, MaxNumberOfMessages=1, VisibilityTimeout=DEFAULT_VISIBILITY_TIMEOUT, **kwargs):
+        return self.backend.transaction(self._receive, MaxNumberOfMessages, VisibilityTimeout)
+
+    def _receive(self, conn, count, visibility_timeout):
+        now = time.time()
+        rows = conn.execute(
+            'SELECT id, message_id, body, receive_count, sent_at, message_attributes FROM messages '
+            'WHERE queue = ? AND visible_at <= ? ORDER BY visible_at, id LIMIT ?',
+            (self.name, now, count)).fetchall()
+        messages = [LocalMessage(self, row_id, message_id, body, receive_count + 1, sent_at,
+                                 '{}:{}'.format(row_id, uuid.uuid4()),
+                                 json.loads(message_attributes) if message_attributes else None)
+                    for row_id, message_id, body, receive_count, sent_at, message_attributes in rows]
+        conn.executemany(
+            'UPDATE messages SET visible_at = ?, receive_count = ?, receipt_handle = ? WHERE id = ?',
+            [(now + visibility_timeout, m.receive_count, m.receipt_handle, m.row_id) for m in messages])
+        return messages
+
+    def delete_messages(self, Entries):
+        return self.backend.transaction(self._delete, Entries)
+
+    def _delete(self, conn, entries):
+        successful, failed = [], []
+        for entry in entries:
+            cursor = conn.execute('DELETE FROM messages WHERE id = ? AND receipt_handle = ?',
+                                  (parse_receipt_handle(entry['ReceiptHandle']), entry['ReceiptHandle']))
+            if cursor.rowcount:
+                successful.append({'Id': entry['Id']})
+            else:
+                failed.append({'Id': entry['Id'], 'SenderFault': True, 'Code': 'ReceiptHandleIsInvalid',
+                               'Message': 'Message was already deleted or received again'})
+        return {'Successful': successful, 'Failed': failed, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def change_visibility(self, receipt_handle, visibility_timeout):
+        self.backend.transaction(lambda conn: conn.execute(
+            'UPDATE messages SET visible_at = ? WHERE id = ? AND receipt_handle = ?',
+            (time.time() + visibility_timeout, parse_receipt_handle(receipt_handle), receipt_handle)))
+
+    def purge(self):
+        self.backend.transaction(lambda conn: conn.execute('DELETE FROM messages WHERE queue = ?', (self.name,)))
+
+    def __repr__(self):
+        return "<LocalQueue: name: {}>".format(self.name)
+
+
+class LocalMessage:
+    def __init__(self, queue, row_id, message_id, body, receive_count, sent_at, receipt_handle,
+                 message_attributes=None):
+        """
+        Class mirroring boto3's SQS Message for a message received from a LocalQueue.
+        """
+        self.queue = queue
+        self.row_id = row_id
+        self.message_id = message_id
+        self.body = body
+        self.receive_count = receive_count
+        self.sent_at = sent_at
+        self.receipt_handle = receipt_handle
+        self.message_attributes = message_attributes
+
+    @property
+    def attributes(self):
+        return {
+            'ApproximateReceiveCount': str(self.receive_count),
+            'SentTimestamp': str(int(self.sent_at * 1000)),
+        }
+
+    def change_visibility(self, VisibilityTimeout):
+        self.queue.change_visibility(self.receipt_handle, VisibilityTimeout)
+
+    def delete(self):
+        return self.queue.delete_messages([{'Id': self.message_id, 'ReceiptHandle': self.receipt_handle}])
+
+    def __repr__(self):
+        return "<LocalMessage: message_id: {}, receive_count: {}>".format(self.message_id, self.receive_count)
@@ -0,0 +1,232 @@
+"""
+Module to keep a single bad message from stopping a script.
+
+Each script processes its messages inside Quarantine.isolate.  A message that fails is sent back to its queue with
+its failure count in a message attribute, and once it has failed MAX_FAILURES times it is moved to the script's
+quarantine queue along with the reason it failed.  Failures caused by an upstream outage rather than the message
+itself, and quota deferrals, are only delayed and don't count as failures, but a message that has been received
+MAX_RECEIVE_COUNT times is quarantined even if its last failure looked transient.
+
+Quarantined messages can be sent back to their queue in bulk once the cause has been fixed:
+
+    python quarantine.py replay radar_search_queue
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import traceback
+from contextlib import contextmanager
+
+import requests
+
+import sqs
+from helpers import CircuitOpenError, CIRCUIT_RESET_TIMEOUT
+
+MAX_FAILURES = int(os.getenv('MAX_FAILURES', 5))
+FAILURE_RETRY_DELAY = int(os.getenv('FAILURE_RETRY_DELAY', 30))
+MAX_RECEIVE_COUNT = int(os.getenv('MAX_RECEIVE_COUNT', 100))
+FAILURE_COUNT_ATTRIBUTE = 'FailureCount'
+QUARANTINE_SUFFIX = '_quarantine'
+
+TRANSIENT_REQUEST_ERRORS = (CircuitOpenError, requests.ConnectionError, requests.Timeout, sqs.SendMessagesError)
+
+# MySQL client errors for a lost connection: can't connect, server has gone away, lost connection during query.
+MYSQL_CONNECTION_ERRORS = (2003, 2006, 2013)
+
+
+def quarantine_queue_name(queue_name):
+    return queue_name + QUARANTINE_SUFFIX
+
+
+def is_transient(err):
+    """
+    Checks whether an error comes from an upstream outage rather than from the message itself.
+
+    Connection errors, timeouts, 5xx responses, open circuits, lost database connections, AWS connection and 5xx
+    errors and queue sends that kept failing are transient.  Other database errors, such as MySQL rejecting a value, count against the message.  Anything else, including malformed urls, counts against the message.  SQLAlchemy and
+    botocore are only imported here so they aren't loaded when the module is imported.
+    :param err: The error raised while processing a message.
+    :return: True if the error is transient.
+    """
+    from sqlalchemy.exc import DBAPIError
+    from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+    if isinstance(err, TRANSIENT_REQUEST_ERRORS):
+        return True
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and err.response.status_code >= 500
+    if isinstance(err, DBAPIError):
+        return err.connection_invalidated or mysql_error_code(err) in MYSQL_CONNECTION_ERRORS
+    if isinstance(err, ClientError):
+        return err.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+    return isinstance(err, (EndpointConnectionError, ReadTimeoutError))
+
+
+def mysql_error_code(err):
+    """
+    Gets the MySQL error code from the driver exception wrapped by a SQLAlchemy DBAPIError.
+
+    :param err: SQLAlchemy DBAPIError.
+    :return: Error code, or None if there isn't one.
+    """
+    args = getattr(err.orig, 'args', ())
+    return args[0] if args else None
+
+
+def receive_count(message):
+    """
+    Number of times the message has been received, including this time, for any reason.
+
+    :param message: Message received with the ApproximateReceiveCount attribute.
+    :return: Receive count.
+    """
+    return int((message.attributes or {}).get('ApproximateReceiveCount', 1))
+
+
+def failure_count(message):
+    """
+    Number of times processing the message has failed before this receive.
+
+    Receives that ended in a quota deferral or an upstream outage are not counted, unlike ApproximateReceiveCount.
+    :param message: Message received with its message attributes.
+    :return: Failure count.
+    """
+    attribute = (message.message_attributes or {}).get(FAILURE_COUNT_ATTRIBUTE, {})
+    return int(attribute.get('StringValue', 0))
+
+
+class Quarantine:
+    def __init__(self, queue_name, queue=None, max_failures=MAX_FAILURES):
+        """
+        Class to isolate failures of single messages from the queue a script reads.
+
+        :param queue_name: Name of the queue the script reads from.
+        :param queue: The queue object, if the script already has it.
+        :param max_failures: Failures after which a message is quarantined.
+        """
+        self.queue_name = queue_name
+        self.max_failures = max_failures
+        self.queue = queue or sqs.get_queue(queue_name)
+        self._quarantine_queue = None
+
+    @property
+    def quarantine_queue(self):
+        if self._quarantine_queue is None:
+            self._quarantine_queue = sqs.create_queue(quarantine_queue_name(self.queue_name))
+        return self._quarantine_queue
+
+    @contextmanager
+    def isolate(self, message):
+        """
+        Context manager that catches and handles any error raised while processing the message.
+
+        Errors raised while handling the failure are logged too, so the script keeps running and the message
+        comes back after its visibility timeout.
+        :param message: Message being processed.
+        :return:
+        """
+        try:
+            yield
+        except Exception as err:
+            logging.exception('Failed to process message {} from {}'.format(message.message_id, self.queue_name))
+            try:
+                self.handle_failure(message, err)
+            except Exception:
+                logging.exception('Failed to handle failure of message {} from {}'.format(
+                    message.message_id, self.queue_name))
+
+    def handle_failure(self, message, err):
+        """
+        Decides whether a failed message is retried, delayed or quarantined.
+
+        :param message: Message that failed.
+        :param err: The error raised while processing it.
+        :return:
+        """
+        if is_transient(err):
+            if receive_count(message) >= MAX_RECEIVE_COUNT:
+                logging.warning('Message {} was received {} times, quarantining despite transient error'.format(
+                    message.message_id, receive_count(message)))
+                self.quarantine(message, err, failure_count(message))
+                return
+            logging.warning('Upstream error, delaying message {}: {}'.format(message.message_id, err))
+            sqs.delay_message(message, CIRCUIT_RESET_TIMEOUT)
+            return
+        failures = failure_count(message) + 1
+        if failures < self.max_failures:
+            logging.warning('Message {} failed {} of {} times, will retry'.format(
+                message.message_id, failures, self.max_failures))
+            self.retry(message, failures)
+            return
+        self.quarantine(message, err, failures)
+
+    def retry(self, message, failures):
+        """
+        Sends the message back to its queue with the new failure count, then deletes the original.
+
+        SQS messages can't be changed in place, so the failure count travels with a new copy of the message.
+        :param message: Message that failed.
+        :param failures: Number of times it has failed, including this time.
+        :return:
+        """
+        message_attributes = {FAILURE_COUNT_ATTRIBUTE: {'DataType': 'Number', 'StringValue': str(failures)}}
+        sqs.send_message(self.queue, message.body, message_attributes, FAILURE_RETRY_DELAY)
+        sqs.delete_message(self.queue, message)
+
+    def quarantine(self, message, err, failures):
+        """
+        Moves the message to the quarantine queue with the reason it failed.
+
+        :param message: Message that failed.
+        :param err: The error raised while processing it.
+        :param failures: Number of times it has failed.
+        :return:
+        """
+        data = {
+            'queue': self.queue_name,
+            'message_id': message.message_id,
+            'body': message.body,
+            'reason': repr(err),
+            'traceback': ''.join(traceback.format_exception(type(err), err, err.__traceback__)),
+            'failure_count': failures,
+            'quarantined_at': time.time(),
+        }
+        sqs.send_message(self.quarantine_queue, json.dumps(data))
+        sqs.delete_message(self.queue, message)
+        logging.warning('Quarantined message {} from {}: {!r}'.format(message.message_id, self.queue_name, err))
+
+    def replay(self, limit=None):
+        """
+        Sends quarantined messages back to the queue they came from.
+
+        :param limit: Maximum number of messages to replay, or None for all of them.
+        :return: Number of messages replayed.
+        """
+        replayed = 0
+        while limit is None or replayed < limit:
+            count = sqs.BATCH_SIZE if limit is None else min(sqs.BATCH_SIZE, limit - replayed)
+            messages = sqs.get_messages(self.quarantine_queue, count)
+            if not messages:
+                break
+            sqs.send_messages(self.queue, [json.loads(message.body)['body'] for message in messages])
+            sqs.delete_messages(self.quarantine_queue, messages)
+            replayed += len(messages)
+        logging.info('Replayed {} messages to {}'.format(replayed, self.queue_name))
+        return replayed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=20, format='%(asctime)s:{}'.format(logging.BASIC_FORMAT))
+    parser = argparse.ArgumentParser(description='Manage quarantined messages.')
+    subparsers = parser.add_subparsers(dest='command')
+    replay_parser = subparsers.add_parser('replay', help='Send quarantined messages back to their queue.')
+    replay_parser.add_argument('queue_name', help='Queue the messages were quarantined from.')
+    replay_parser.add_argument('--limit', type=int, default=None, help='Maximum number of messages to replay.')
+    args = parser.parse_args()
+    if args.command != 'replay':
+        parser.print_help()
+        sys.exit(1)
+    Quarantine(args.queue_name).replay(args.limit)
@@ -0,0 +1,165 @@
+"""
+Module to keep Google API usage under the daily and per second budget across every worker on the box.
+
+Usage is tracked in a local SQLite file so separate worker processes share the same counters.  The budget is
+split between the radar search and place details buckets so that radar fan-out cannot starve place details.
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pytz
+
+QUOTA_DB_PATH = os.getenv('GOOGLE_QUOTA_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 'google_quota.db'))
+GOOGLE_DAILY_QUOTA = int(os.getenv('GOOGLE_DAILY_QUOTA', 150000))
+GOOGLE_QUERIES_PER_SECOND = float(os.getenv('GOOGLE_QUERIES_PER_SECOND', 50))
+GOOGLE_RADAR_QUOTA_SHARE = float(os.getenv('GOOGLE_RADAR_QUOTA_SHARE', 0.2))
+QUOTA_RETRY_DELAY = int(os.getenv('GOOGLE_QUOTA_RETRY_DELAY', 60))
+
+RADAR_BUCKET = 'radar'
+DETAILS_BUCKET = 'details'
+
+# Google resets daily quotas at midnight Pacific time.
+QUOTA_TIMEZONE = pytz.timezone('US/Pacific')
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS quota (
+    bucket TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    used INTEGER NOT NULL,
+    next_allowed REAL NOT NULL
+);
+"""
+
+_quota_manager = None
+_quota_manager_lock = threading.Lock()
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, bucket, retry_after):
+        """
+        Raised when a Google API budget is used up or Google answers with OVER_QUERY_LIMIT.
+
+        :param bucket: Name of the quota bucket that ran out.
+        :param retry_after: Seconds to wait before the work should be retried.
+        """
+        super().__init__('Google quota exceeded for {}, retry after {}s'.format(bucket, retry_after))
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def default_budgets(daily=GOOGLE_DAILY_QUOTA, per_second=GOOGLE_QUERIES_PER_SECOND,
+                    radar_share=GOOGLE_RADAR_QUOTA_SHARE):
+    """
+    Splits the Google budget between the radar search and place details buckets.
+
+    :param daily: Total number of requests allowed per day.
+    :param per_second: Total number of requests allowed per second.
+    :param radar_share: Fraction of the budget given to radar search.
+    :return: Dict of bucket name to (daily, per_second) budget.
+    """
+    return {
+        RADAR_BUCKET: (int(daily * radar_share), per_second * radar_share),
+        DETAILS_BUCKET: (daily - int(daily * radar_share), per_second * (1 - radar_share)),
+    }
+
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+
+def seconds_until_reset():
+    """
+    Seconds until the Google daily quota resets.
+
+    :return: Seconds until the next midnight Pacific time.
+    """
+    now = datetime.now(QUOTA_TIMEZONE)
+    midnight = QUOTA_TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    return int((midnight - now).total_seconds()) + 1
+
+
+class QuotaManager:
+    def __init__(self, path=QUOTA_DB_PATH, budgets=None):
+        """
+        Class to pace Google API requests against a budget shared by every process using the same file.
+
+        :param path: Path to the SQLite file holding the usage counters.
+        :param budgets: Dict of bucket name to (daily, per_second) budget.
+        """
+        self.path = path
+        self.budgets = budgets or default_budgets()
+        with closing(self.connect()) as conn:
+            conn.execute(CREATE_TABLE_QUERY)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def acquire(self, bucket):
+        """
+        Reserves one request from the bucket, sleeping as needed to stay under the per second budget.
+
+        :param bucket: Name of the quota bucket to take from.
+        :return:
+        """
+        daily, per_second = self.budgets[bucket]
+        wait = self.reserve(bucket, daily, per_second)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, bucket, daily, per_second):
+        """
+        Takes one request from the bucket and returns how long to wait before sending it.
+
+        Requests are spaced 1 / per_second seconds apart by handing out time slots from next_allowed.
+        :param bucket: Name of the quota bucket to take from.
+        :param daily: Daily budget of the bucket.
+        :param per_second: Per second budget of the bucket.
+        :return: Seconds to wait before sending the request.
+        """
+        day = quota_day()
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT day, used, next_allowed FROM quota WHERE bucket = ?', (bucket,)).fetchone()
+            if row is None or row[0] != day:
+                used, next_allowed = 0, now
+            else:
+                used, next_allowed = row[1], row[2]
+            if used >= daily:
+                conn.execute('ROLLBACK')
+                raise QuotaExceededError(bucket, seconds_until_reset())
+            slot = max(now, next_allowed)
+            conn.execute('INSERT OR REPLACE INTO quota (bucket, day, used, next_allowed) VALUES (?, ?, ?, ?)',
+                         (bucket, day, used + 1, slot + 1.0 / per_second))
+            conn.execute('COMMIT')
+        return slot - now
+
+    def usage(self, bucket):
+        """
+        Number of requests taken from the bucket today.
+
+        :param bucket: Name of the quota bucket.
+        :return: Requests used today.
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute('SELECT day, used FROM quota WHERE bucket = ?', (bucket,)).fetchone()
+        if row is None or row[0] != quota_day():
+            return 0
+        return row[1]
+
+
+def get_quota_manager():
+    global _quota_manager
+    with _quota_manager_lock:
+        if _quota_manager is None:
+            _quota_manager = QuotaManager()
+            logging.info('Google quota budgets: {}'.format(_quota_manager.budgets))
+        return _quota_manager
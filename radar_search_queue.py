@@ -7,9 +7,13 @@ import os
 import logging
 import time
 
-from helpers import APIHandler
+from helpers import (APIHandler, RADAR_RESULT_LIMIT, MIN_RADAR_RADIUS, make_radar_url,
+                     parse_radar_url, subdivide_radar_cell)
 
 import sqs
+from backpressure import Throttle
+from quarantine import Quarantine
+from quota import QuotaExceededError, RADAR_BUCKET
 
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 BOTO_QUEUE_NAME_RADAR = 'radar_search_queue'
@@ -28,21 +32,47 @@ def make_url(place_id):
     return url
 
 
-def make_request(queue, message):
+def subdivide(radar_queue, message):
+    """
+    Sends the quadtree children of a saturated radar search back to the radar search queue.
+
+    :param radar_queue: The radar search SQS container.
+    :param message: The radar search url that came back saturated.
+    :return: True if the search was subdivided, False if it is already at the minimum radius.
+    """
+    lat, lng, radius = parse_radar_url(message)
+    if radius / 2 < MIN_RADAR_RADIUS:
+        logging.info('Radar search saturated at minimum radius: {},{} radius {}'.format(lat, lng, radius))
+        return False
+    logging.info('Radar search saturated, subdividing: {},{} radius {}'.format(lat, lng, radius))
+    sqs.send_messages(radar_queue, [make_radar_url(child_lat, child_lng, child_radius)
+                                    for child_lat, child_lng, child_radius in subdivide_radar_cell(lat, lng, radius)])
+    return True
+
+
+def make_request(queue, message, radar_queue=None):
     """
     Iterates over the list of places returned from the radar search and builds a URL for each
     place.
 
+    A search that hits the result limit is split into four smaller searches that are sent back to the
+    radar search queue instead, since the results of the saturated search are truncated.
     :param queue: The google places SQS container.
     :param message: The message received from the radar search queue.
+    :param radar_queue: The radar search SQS container, needed to subdivide saturated searches.
     :return:
     """
-    places = APIHandler(message)
-    for place in places.get_load().get('results', ''):
+    places = APIHandler(message, quota_bucket=RADAR_BUCKET)
+    results = places.get_load().get('results', [])
+    if radar_queue and len(results) >= RADAR_RESULT_LIMIT:
+        if subdivide(radar_queue, message):
+            return
+    urls = []
+    for place in results:
         place_id = place.get('place_id', '')
         if place_id:
-            url = make_url(place_id)
-            sqs.send_message(queue, url)
+            urls.append(make_url(place_id))
+    sqs.send_messages(queue, urls)
 
 
 def run():
@@ -50,19 +80,30 @@ def run():
     Runner for radar_search_queue.py.
 
     If there is no message returned from get_message, the program will sleep for 5 seconds and then
-    check again.  Once all requests have been completed, the message is deleted from the queue.
+    check again.  Once all requests have been completed, the message is deleted from the queue.  If the Google
+    quota is used up the message is left on the queue and retried after a delay.  The script slows down or
+    pauses while the google places queue is backed up.  A message that keeps failing is quarantined.
     :return:
     """
     radar_queue = sqs.get_queue(BOTO_QUEUE_NAME_RADAR)
     places_queue = sqs.get_queue(BOTO_QUEUE_NAME_PLACES)
+    quarantine = Quarantine(BOTO_QUEUE_NAME_RADAR, radar_queue)
+    throttle = Throttle(places_queue)
     while True:
+        throttle.wait()
         message = sqs.get_message(radar_queue)
         if not message:
             logging.info(os.path.basename(__file__))
             time.sleep(5)
             continue
-        make_request(places_queue, message.body)
-        sqs.delete_message(radar_queue, message)
+        with quarantine.isolate(message):
+            try:
+                make_request(places_queue, message.body, radar_queue)
+            except QuotaExceededError as err:
+                logging.warning(err)
+                sqs.delay_message(message, err.retry_after)
+                continue
+            sqs.delete_message(radar_queue, message)
 
 
 if __name__ == '__main__':
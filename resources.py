@@ -0,0 +1,106 @@
+"""
+Registry of shared resources for the queue scripts.
+
+The database engine, session factory, SQS resource and queue backend are created the first time they are asked for instead of
+at import time, so modules that only need parsers or helpers don't pull in the database or AWS, and workers are
+ready to poll as soon as possible.
+"""
+import os
+import threading
+
+BOTO_REGION = 'us-west-2'
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'sqs')
+
+AWS_ACCESS_KEY = os.getenv('PERSONAL_AWS_ACCESS_KEY')
+AWS_SECRET_KEY = os.getenv('PERSONAL_AWS_SECRET_KEY')
+
+_resources = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name, factory):
+    """
+    Gets a resource from the registry, creating it with factory if it doesn't exist yet.
+
+    :param name: Name of the resource.
+    :param factory: Callable that creates the resource.
+    :return: The shared resource.
+    """
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+    with _lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+
+def _create_engine():
+    import sqlalchemy
+    return sqlalchemy.create_engine(os.getenv('HAPPYFINDER_ENGINE'), encoding='utf8')
+
+
+def _create_session_factory():
+    from sqlalchemy.orm import sessionmaker
+    return sessionmaker(get_engine())
+
+
+def _create_sqs():
+    import boto3
+    return boto3.resource('sqs', region_name=BOTO_REGION, aws_access_key_id=AWS_ACCESS_KEY,
+                          aws_secret_access_key=AWS_SECRET_KEY)
+
+
+def _create_queue_backend():
+    if QUEUE_BACKEND == 'sqs':
+        from sqs import SQSBackend
+        return SQSBackend()
+    if QUEUE_BACKEND == 'sqlite':
+        from local_queue import SQLiteBackend
+        return SQLiteBackend()
+    raise ValueError('Unknown QUEUE_BACKEND: {}'.format(QUEUE_BACKEND))
+
+
+def get_engine():
+    """
+    Get the shared SQLAlchemy engine for HAPPYFINDER_ENGINE.
+
+    :return: SQLAlchemy engine.
+    """
+    return _get_or_create('engine', _create_engine)
+
+
+def get_session_factory():
+    """
+    Get the shared session factory bound to the engine.
+
+    :return: SQLAlchemy sessionmaker.
+    """
+    return _get_or_create('session_factory', _create_session_factory)
+
+
+def get_session():
+    """
+    Create a new database session.
+
+    :return: SQLAlchemy session.
+    """
+    return get_session_factory()()
+
+
+def get_sqs():
+    """
+    Get the shared boto3 SQS resource.
+
+    :return: boto3 SQS resource.
+    """
+    return _get_or_create('sqs', _create_sqs)
+
+
+def get_queue_backend():
+    """
+    Get the shared queue backend chosen by QUEUE_BACKEND, either 'sqs' or 'sqlite'.
+
+    :return: Queue backend.
+    """
+    return _get_or_create('queue_backend', _create_queue_backend)
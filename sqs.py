@@ -1,30 +1,72 @@
 """
 Module to maintain consistency across scripts/modules when accessing SQS queues.
+
+Queues come from the backend chosen by the QUEUE_BACKEND environment variable: 'sqs' for AWS SQS or 'sqlite' for
+the local queue in local_queue.py.  A backend provides get_queue(queue_name) and create_queue(queue_name); the
+queues and messages they return follow the boto3 SQS Queue and Message API.
 """
 
-import os
 import logging
-import boto3
 
-BOTO_REGION = 'us-west-2'
+from resources import get_sqs, get_queue_backend
+
+MAX_VISIBILITY_TIMEOUT = 43200
+BATCH_SIZE = 10
+MESSAGE_ATTRIBUTE_NAMES = ['All']
+ATTRIBUTE_NAMES = ['ApproximateReceiveCount']
+
+
+class SendMessagesError(Exception):
+    pass
+
+
+class SQSBackend:
+    def get_queue(self, queue_name):
+        """
+        Get an aws SQS object by name.
 
-AWS_ACCESS_KEY = os.getenv('PERSONAL_AWS_ACCESS_KEY')
-AWS_SECRET_KEY = os.getenv('PERSONAL_AWS_SECRET_KEY')
+        See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#queue
 
-sqs = boto3.resource('sqs', region_name=BOTO_REGION, aws_access_key_id=AWS_ACCESS_KEY,
-                     aws_secret_access_key=AWS_SECRET_KEY)
+        :param queue_name:
+        :return:
+        """
+        return get_sqs().get_queue_by_name(QueueName=queue_name)
+
+    def create_queue(self, queue_name):
+        """
+        Get an aws SQS object by name, creating the queue if it doesn't exist.  SQS create_queue is idempotent.
+
+        See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#SQS.ServiceResource.create_queue
+
+        :param queue_name:
+        :return:
+        """
+        return get_sqs().create_queue(QueueName=queue_name)
+
+
+def chunks(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 def get_queue(queue_name):
     """
-    Get an aws SQS object by name.
+    Get a queue object by name from the configured backend.
+
+    :param queue_name:
+    :return:
+    """
+    return get_queue_backend().get_queue(queue_name)
 
-    See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#queue
+
+def create_queue(queue_name):
+    """
+    Get a queue object by name from the configured backend, creating the queue if it doesn't exist.
 
     :param queue_name:
     :return:
     """
-    return sqs.get_queue_by_name(QueueName=queue_name)
+    return get_queue_backend().create_queue(queue_name)
 
 
 def get_message(queue):
@@ -34,12 +76,37 @@ def get_message(queue):
     :param queue: The queue to receive a message from.
     :return: Message received from the queue, or none.
     """
-    message = queue.receive_messages(MaxNumberOfMessages=1)
+    message = queue.receive_messages(MaxNumberOfMessages=1, AttributeNames=ATTRIBUTE_NAMES,
+                                     MessageAttributeNames=MESSAGE_ATTRIBUTE_NAMES)
     if not message:
         return None
     return message[0]
 
 
+def get_messages(queue, count=BATCH_SIZE):
+    """
+    Receives up to count messages from the queue in one call.
+
+    :param queue: The queue to receive messages from.
+    :param count: Maximum number of messages to receive, at most 10 for SQS.
+    :return: List of messages, possibly empty.
+    """
+    return queue.receive_messages(MaxNumberOfMessages=count, AttributeNames=ATTRIBUTE_NAMES,
+                                  MessageAttributeNames=MESSAGE_ATTRIBUTE_NAMES)
+
+
+def delay_message(message, delay):
+    """
+    Hides the message from the queue for the given delay so it is retried later instead of lost.
+
+    See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#SQS.Message.change_visibility
+    :param message: The message to delay.
+    :param delay: Seconds until the message is visible again, capped at the SQS maximum of 12 hours.
+    :return:
+    """
+    message.change_visibility(VisibilityTimeout=min(int(delay), MAX_VISIBILITY_TIMEOUT))
+
+
 def check_errors(response):
     """
     Checks for an error response from SQS after sending a message.
@@ -47,23 +114,60 @@ def check_errors(response):
     :param response: The response from SQS.
     :return: The response after checking and logging Errors.
     """
-    if response.get('ResponseMetadata', '').get('HTTPStatusCode', '') is not 200:
+    if response.get('ResponseMetadata', {}).get('HTTPStatusCode', '') != 200 or response.get('Failed'):
         logging.info('ERROR! {}'.format(response))
     return response
 
 
-def send_message(queue, data):
+def send_message(queue, data, message_attributes=None, delay=0):
     """
     Sends a message up to the specified SQS Queue.
 
     :param queue: The queue to send the message to.
     :param data: The data to be sent to the queue.
+    :param message_attributes: Optional SQS message attributes to send with the message.
+    :param delay: Seconds before the message becomes visible, at most 900.
     :return:
     """
-    response = queue.send_message(MessageBody=data)
+    kwargs = {'MessageAttributes': message_attributes} if message_attributes else {}
+    response = queue.send_message(MessageBody=data, DelaySeconds=delay, **kwargs)
     check_errors(response)
 
 
+def send_messages(queue, data_list):
+    """
+    Sends messages to the specified queue in batches of 10.
+
+    See: http://boto3.readthedocs.io/en/latest/reference/services/sqs.html#SQS.Queue.send_messages
+    Entries that fail are retried once.  If any still fail SendMessagesError is raised, so the caller doesn't
+    delete the message the batch was built from and the work isn't lost.
+    :param queue: The queue to send the messages to.
+    :param data_list: List of message bodies.
+    :return:
+    """
+    for batch in chunks(list(data_list)):
+        entries = [{'Id': str(i), 'MessageBody': data} for i, data in enumerate(batch)]
+        failed = send_batch(queue, entries)
+        if failed:
+            logging.info('Retrying {} failed entries'.format(len(failed)))
+            failed = send_batch(queue, failed)
+        if failed:
+            raise SendMessagesError('Failed to send {} messages to {}'.format(len(failed), queue.url))
+
+
+def send_batch(queue, entries):
+    """
+    Sends one batch of entries to the queue.
+
+    :param queue: The queue to send the messages to.
+    :param entries: Batch entries with Id and MessageBody.
+    :return: The entries that failed.
+    """
+    response = check_errors(queue.send_messages(Entries=entries))
+    failed_ids = set(failure['Id'] for failure in response.get('Failed', []))
+    return [entry for entry in entries if entry['Id'] in failed_ids]
+
+
 def delete_message(queue, message):
     """
     Delete the message from the queue.
@@ -79,17 +183,31 @@ def delete_message(queue, message):
     ]
     response = queue.delete_messages(Entries=entries)
 
-    successful = response.get('Successful', [{}])[0].get('Id') == message.message_id
+    successful = (response.get('Successful') or [{}])[0].get('Id') == message.message_id
     if successful:
         return
 
-    failure_details = response.get('Failed', [{}])
+    failure_details = (response.get('Failed') or [{}])[0]
     failed_message_id = failure_details.get('Id')
     if failed_message_id != message.message_id:
         raise ValueError('Delete message was unsuccessful but failed message id does not match expected message id. '
                          'failed_message_id={} expected_message_id={}'.format(failed_message_id, message.message_id))
 
-    raise ('Details: {}\nID: {}'.format(failure_details, failed_message_id))
+    raise ValueError('Details: {}\nID: {}'.format(failure_details, failed_message_id))
+
+
+def delete_messages(queue, messages):
+    """
+    Delete messages from the queue in batches of 10.
+
+    Failures are logged rather than raised, since the messages will simply be received again.
+    :param queue: The queue the messages were received from.
+    :param messages: List of messages to delete.
+    :return:
+    """
+    for batch in chunks(list(messages)):
+        entries = [{'Id': str(i), 'ReceiptHandle': message.receipt_handle} for i, message in enumerate(batch)]
+        check_errors(queue.delete_messages(Entries=entries))
 
 
 if __name__ == '__main__':